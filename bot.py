@@ -1,12 +1,17 @@
 import asyncio
+import html
 import logging
 import os
 import random
+import re
 import sqlite3
-from itertools import islice
+import sys
+import threading
+import time
 import aiohttp
-import pymorphy2
+import orjson
 from aiogram import Bot, Dispatcher, Router
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.fsm.context import FSMContext
@@ -25,8 +30,25 @@ NOTIFICATION_CHANNEL_ID: str = os.getenv("NOTIFICATION_CHANNEL_ID", "")
 OZON_API_URL: str = "https://api-seller.ozon.ru"
 OZON_TOKEN: str = os.getenv("OZON_TOKEN", "")
 CLIENT_ID: str = os.getenv("CLIENT_ID", "")
-CHECK_INTERVAL: int = int(os.getenv("CHECK_INTERVAL", 300))
+CHECK_INTERVAL: int = int(os.getenv("CHECK_INTERVAL") or 300)
+MAX_CHECK_INTERVAL: int = int(os.getenv("MAX_CHECK_INTERVAL") or 900)  # Предел увеличения интервала при пустых опросах (не меньше CHECK_INTERVAL)
 MAX_USERS: int = 5  # Максимальное количество пользователей
+DB_PATH: str = "ozon_reviews.db"
+SKU_CACHE_TTL: int = 600  # Время жизни кэша информации о товаре, в секундах
+SKU_CACHE_SIZE: int = 1024  # Максимальное количество товаров в кэше
+REVIEW_CONCURRENCY: int = 5  # Сколько отзывов обрабатывается одновременно
+CHANNEL_SEND_INTERVAL: float = 3.0  # Пауза между сообщениями в канал: Telegram пропускает ~20 в минуту
+CHANNEL_SEND_RETRIES: int = 3  # Попыток отправки в канал при ответе Telegram «retry after»
+
+# Заголовки запросов к Ozon API (одинаковы для всех методов, задаются на уровне сессии)
+_OZON_HEADERS: dict[str, str] = {
+    "Client-Id": CLIENT_ID,
+    "Api-Key": OZON_TOKEN,
+    "Content-Type": "application/json",
+}
+
+# Постоянное тело запроса к /v1/review/list
+_UNPROCESSED_PAYLOAD: dict = {"limit": 50, "sort_dir": "ASC", "status": "UNPROCESSED"}
 
 # Инициализация бота и диспетчера
 bot: Bot = Bot(token=TELEGRAM_BOT_TOKEN)
@@ -38,10 +60,26 @@ class UserStates(StatesGroup):
     waiting_for_start = State()
 
 
+# Постоянное соединение с базой данных, открывается в init_db.
+# Соединение общее для всех потоков (check_same_thread=False), поэтому обращения к нему сериализуются блокировкой
+_DB: sqlite3.Connection | None = None
+_DB_LOCK = threading.Lock()
+# Количество активных пользователей; загружается в init_db и меняется только под _DB_LOCK
+_ACTIVE_USER_COUNT: int = 0
+# Идентификаторы обработанных отзывов; загружаются в init_db и пополняются в save_reviews_to_db
+_PROCESSED_IDS: set[str] = set()
+
+
 def init_db() -> None:
     """Инициализация базы данных и создание таблиц."""
-    conn = sqlite3.connect("ozon_reviews.db")
-    cursor = conn.cursor()
+    global _DB, _ACTIVE_USER_COUNT, _PROCESSED_IDS
+    _DB = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+    cursor = _DB.cursor()
+    # WAL позволяет читать параллельно с записью, NORMAL убирает fsync на каждую транзакцию
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-64000")  # 64 МБ кэша страниц на соединение
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS processed_reviews (
             review_id TEXT PRIMARY KEY,
@@ -53,7 +91,7 @@ def init_db() -> None:
             response_text TEXT,
             comment_id TEXT,
             processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
+        ) WITHOUT ROWID
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -62,69 +100,62 @@ def init_db() -> None:
             is_active INTEGER DEFAULT 1
         )
     """)
-    conn.commit()
-    conn.close()
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_active ON users(is_active)")
+    _ACTIVE_USER_COUNT = cursor.execute("SELECT COUNT(*) FROM users WHERE is_active = 1").fetchone()[0]
+    _PROCESSED_IDS = {row[0] for row in cursor.execute("SELECT review_id FROM processed_reviews")}
 
 
-def save_review_to_db(review_id: str, sku: str, product_name: str, user_name: str, review_text: str, rating: int, response_text: str, comment_id: str) -> None:
-    """Сохранить обработанный отзыв в базу данных."""
-    conn = sqlite3.connect("ozon_reviews.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO processed_reviews (review_id, sku, product_name, user_name, review_text, rating, response_text, comment_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (review_id, sku, product_name, user_name, review_text, rating, response_text, comment_id))
-    conn.commit()
-    conn.close()
+# Текст запроса неизменен, поэтому sqlite3 берет подготовленный оператор из кэша соединения
+_INSERT_REVIEW_SQL = """
+    INSERT INTO processed_reviews (review_id, sku, product_name, user_name, review_text, rating, response_text, comment_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
 
-def is_review_processed(review_id: str) -> bool:
-    """Проверить, обработан ли отзыв ранее."""
-    conn = sqlite3.connect("ozon_reviews.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM processed_reviews WHERE review_id = ?", (review_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+def save_reviews_to_db(rows: list[tuple]) -> None:
+    """Сохранить пачку обработанных отзывов в базу данных одной транзакцией."""
+    if not rows:
+        return
+    with _DB_LOCK, _DB:
+        _DB.execute("BEGIN")
+        _DB.executemany(_INSERT_REVIEW_SQL, rows)
+    _PROCESSED_IDS.update(row[0] for row in rows)
 
 
 def add_user(user_id: int, username: str) -> bool:
     """Добавить пользователя в базу данных."""
-    conn = sqlite3.connect("ozon_reviews.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM users WHERE is_active = 1")
-    active_users = cursor.fetchone()[0]
-    if active_users >= MAX_USERS:
-        conn.close()
-        return False
-    cursor.execute("""
-        INSERT OR IGNORE INTO users (user_id, username, is_active)
-        VALUES (?, ?, 1)
-    """, (user_id, username))
-    conn.commit()
-    conn.close()
+    global _ACTIVE_USER_COUNT
+    with _DB_LOCK:
+        if _ACTIVE_USER_COUNT >= MAX_USERS:
+            return False
+        cursor = _DB.execute("""
+            INSERT OR IGNORE INTO users (user_id, username, is_active)
+            VALUES (?, ?, 1)
+        """, (user_id, username))
+        if cursor.rowcount == 1:
+            _ACTIVE_USER_COUNT += 1
     return True
 
 
 def get_active_users() -> list:
     """Получить список активных пользователей."""
-    conn = sqlite3.connect("ozon_reviews.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id FROM users WHERE is_active = 1")
-    users = cursor.fetchall()
-    conn.close()
+    with _DB_LOCK:
+        users = _DB.execute("SELECT user_id FROM users WHERE is_active = 1").fetchall()
     return [user[0] for user in users]
 
 
 async def notify_users(message: str) -> None:
     """Отправить уведомление всем активным пользователям."""
-    active_users = get_active_users()
-    for user_id in active_users:
-        try:
-            await bot.send_message(user_id, message, parse_mode="HTML")
-            logging.info(f"Уведомление отправлено пользователю {user_id}")
-        except Exception as e:
-            logging.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+    active_users = await asyncio.to_thread(get_active_users)
+    results = await asyncio.gather(
+        *(bot.send_message(user_id, message, parse_mode="HTML") for user_id in active_users),
+        return_exceptions=True,
+    )
+    for user_id, result in zip(active_users, results):
+        if isinstance(result, BaseException):
+            logging.error("Ошибка отправки уведомления пользователю %s: %s", user_id, result)
+        else:
+            logging.info("Уведомление отправлено пользователю %s", user_id)
 
 
 @router.message(Command(commands=["start", "help"]))
@@ -144,7 +175,7 @@ async def handle_start_button(callback: CallbackQuery, state: FSMContext) -> Non
     user_id = callback.from_user.id
     username = callback.from_user.username or str(user_id)
 
-    if add_user(user_id, username):
+    if await asyncio.to_thread(add_user, user_id, username):
         await callback.message.answer("✅ Вы успешно активировали бота! Теперь вы будете получать уведомления о новых отзывах.")
     else:
         await callback.message.answer("❌ Извините, достигнуто максимальное количество пользователей (5).")
@@ -152,11 +183,105 @@ async def handle_start_button(callback: CallbackQuery, state: FSMContext) -> Non
     await state.clear()
 
 
+def _orjson_dumps(obj) -> str:
+    """Сериализация тел запросов через orjson (aiohttp ожидает str, orjson возвращает bytes)."""
+    return orjson.dumps(obj).decode()
+
+
+async def _ozon_post(path: str, payload: dict, session: aiohttp.ClientSession) -> dict | None:
+    """
+    Отправить POST-запрос к Ozon API.
+
+    Args:
+        path (str): Путь метода, например "/v1/review/list".
+        payload (dict): Тело запроса.
+        session (aiohttp.ClientSession): Сессия для выполнения HTTP-запросов.
+
+    Returns:
+        dict | None: Разобранный ответ при статусе 200, иначе None (ошибка уже записана в лог).
+    """
+    try:
+        async with session.post(f"{OZON_API_URL}{path}", json=payload) as response:
+            logging.info("Запрос к Ozon API %s: статус ответа %s", path, response.status)
+            result = await response.json(loads=orjson.loads)
+            if response.status == 200:
+                return result
+            logging.error("Ошибка Ozon API %s: %s", path, result)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # При срабатывании ClientTimeout сессии aiohttp бросает TimeoutError, а не ClientError
+        logging.error("Ошибка сети при запросе к Ozon API %s: %s", path, str(e) or "превышено время ожидания")
+    return None
+
+
+# Кэш информации о товарах по SKU и запросы к Ozon, которые выполняются в данный момент
+_SKU_CACHE: dict[int, tuple[float, dict]] = {}
+_inflight: dict[int, asyncio.Task] = {}
+
+
+def _cache_product_info(sku: int, info: dict) -> None:
+    """Сохранить информацию о товаре в кэш, вытесняя самую старую запись при переполнении."""
+    if len(_SKU_CACHE) >= SKU_CACHE_SIZE and sku not in _SKU_CACHE:
+        del _SKU_CACHE[next(iter(_SKU_CACHE))]
+    _SKU_CACHE[sku] = (time.monotonic(), info)
+
+
+def _item_skus(item: dict) -> set[int]:
+    """Все SKU товара из ответа /v3/product/info/list (поле sku и источники sources)."""
+    skus = {source.get("sku") for source in item.get("sources") or []}
+    skus.add(item.get("sku"))
+    return {int(sku) for sku in skus if sku}
+
+
+async def _fetch_products_info(skus: list[int], session: aiohttp.ClientSession) -> dict[int, dict]:
+    """Запросить информацию о нескольких товарах одним запросом к Ozon API и сохранить ее в кэш."""
+    result = await _ozon_post("/v3/product/info/list", {"sku": skus}, session)  # В тело передается массив SKU
+    if result is None:
+        return {}
+
+    items = result.get("items")
+    if not items:
+        logging.error("Ошибка при получении информации о товарах SKU %s: %s", skus, result)
+        return {}
+
+    found: dict[int, dict] = {}
+    if len(skus) == 1:
+        found[skus[0]] = items[0]  # Данные единственного запрошенного товара
+    else:
+        requested = set(skus)
+        for item in items:
+            for sku in _item_skus(item) & requested:
+                found[sku] = item
+    for sku, info in found.items():
+        _cache_product_info(sku, info)
+    return found
+
+
+async def _fetch_product_info(sku: int, session: aiohttp.ClientSession) -> dict:
+    """Запросить информацию об одном товаре в Ozon API."""
+    found = await _fetch_products_info([sku], session)
+    return found.get(sku, {})
+
+
+async def prefetch_products_info(skus: list, session: aiohttp.ClientSession) -> None:
+    """Загрузить в кэш информацию о товарах, которых там еще нет, одним запросом к Ozon API."""
+    now = time.monotonic()
+    missing = []
+    for sku in {int(sku) for sku in skus if sku}:
+        ts, info = _SKU_CACHE.get(sku, (0.0, None))
+        if (info is None or now - ts >= SKU_CACHE_TTL) and sku not in _inflight:
+            missing.append(sku)
+
+    if missing:
+        await _fetch_products_info(sorted(missing), session)
+
+
 async def get_product_info_from_card(sku: int, session: aiohttp.ClientSession) -> dict:
     """
     Получает информацию о товаре через Ozon API по SKU.
 
     Использует метод /v3/product/info/list для получения подробных данных.
+    Ответ кэшируется на SKU_CACHE_TTL секунд, а одновременные запросы
+    одного и того же SKU объединяются в один запрос к API.
 
     Args:
         sku (int): Идентификатор товара в системе Ozon.
@@ -169,28 +294,18 @@ async def get_product_info_from_card(sku: int, session: aiohttp.ClientSession) -
         logging.warning("SKU отсутствует, запрос пропущен.")
         return {}
 
-    # Конечная точка для запроса информации о товарах
-    url = f"{OZON_API_URL}/v3/product/info/list"
-    headers = {
-        "Client-Id": CLIENT_ID,
-        "Api-Key": OZON_TOKEN,
-        "Content-Type": "application/json",
-    }
-    payload = {"sku": [int(sku)]}  # В тело передается массив SKU
-
-    try:
-        async with session.post(url, json=payload, headers=headers) as response:
-            logging.info(f"Запрос к Ozon API: статус ответа {response.status}")
-            result = await response.json()
+    sku = int(sku)
+    ts, info = _SKU_CACHE.get(sku, (0.0, None))
+    if info is not None and time.monotonic() - ts < SKU_CACHE_TTL:
+        return info
 
-            if response.status == 200 and "items" in result and len(result["items"]) > 0:
-                return result["items"][0]  # Возвращаем данные первого товара в списке
-            else:
-                logging.error(f"Ошибка при получении информации о товаре SKU {sku}: {result}")
-    except aiohttp.ClientError as e:
-        logging.error(f"Ошибка запроса к Ozon API для SKU {sku}: {e}")
-
-    return {}
+    task = _inflight.get(sku)
+    if task is None:
+        task = asyncio.create_task(_fetch_product_info(sku, session))
+        _inflight[sku] = task
+        task.add_done_callback(lambda _: _inflight.pop(sku, None))
+    # shield: отмена одного ожидающего не должна отменять общий запрос
+    return await asyncio.shield(task)
 
 
 async def get_product_name_and_brand_by_sku(sku: int, session: aiohttp.ClientSession) -> tuple[str, str]:
@@ -205,291 +320,326 @@ async def get_product_name_and_brand_by_sku(sku: int, session: aiohttp.ClientSes
     return product_name, brand_name
 
 
+# Известные бренды в начале строки; номер совпавшей группы указывает на каноническое название
+_BRAND_RE = re.compile(r"(diana\s*store)|((?:ooo\s+)?guten\s+morgen)")
+_BRAND_BY_GROUP: tuple[str, ...] = ("", "Diana Store", "Guten Morgen")
+
+
 def get_brand_name(brand: str) -> str:
     """Извлекает название бренда из строки."""
     brand = brand.strip().lower()
 
     if "|" in brand:
-        brand_name = brand.split("|")[0].strip()
-    elif "/" in brand:
-        brand_name = brand.split("/")[0].strip()
+        brand_name = brand.partition("|")[0].strip()
     else:
-        brand_name = brand
-
-    brand_mapping = {
-        "diana store": "Diana Store",
-        "guten morgen": "Guten Morgen",
-        "ooo guten morgen": "Guten Morgen",
-        "dianastore": "Diana Store",
-    }
+        brand_name = brand.partition("/")[0].strip()
 
-    for key in brand_mapping:
-        if brand_name.startswith(key):
-            return brand_mapping[key]
+    match = _BRAND_RE.match(brand_name)
+    if match:
+        return _BRAND_BY_GROUP[match.lastindex]
 
     return "Guten Morgen"
 
 
-async def get_unprocessed_reviews(session: aiohttp.ClientSession) -> list:
-    url = f"{OZON_API_URL}/v1/review/list"
-    headers = {
-        "Client-Id": CLIENT_ID,
-        "Api-Key": OZON_TOKEN,
-        "Content-Type": "application/json",
-    }
-    payload = {"limit": 50, "sort_dir": "ASC", "status": "UNPROCESSED"}
+async def get_unprocessed_reviews(session: aiohttp.ClientSession) -> tuple[int, list] | None:
+    """
+    Получить общее количество необработанных отзывов и первую страницу самих отзывов одним запросом.
 
-    try:
-        async with session.post(url, json=payload, headers=headers) as response:
-            logging.info(f"Статус ответа: {response.status}")
-            result = await response.json()
-            logging.info(f"Ответ API: {result}")
-            if response.status == 200:
-                return result.get("reviews", [])
-            else:
-                logging.error(f"Ошибка при запросе отзывов: {result}")
-                return []
-    except aiohttp.ClientError as e:
-        logging.error(f"Ошибка сети при запросе API: {e}")
-        return []
+    Возвращает None, если запрос к Ozon API не удался (в отличие от пустой очереди).
+    """
+    result = await _ozon_post("/v1/review/list", _UNPROCESSED_PAYLOAD, session)
+    if result is None:
+        return None
+
+    reviews = result.get("reviews", [])
+    total_reviews = int(result.get("total", len(reviews)))  # Поле для общего количества
+    logging.info("Ответ API: получено %d отзывов, всего необработанных %d", len(reviews), total_reviews)
+    return total_reviews, reviews
 
 
 async def post_comment(review_id: str, text: str, session: aiohttp.ClientSession) -> str:
     """Отправить комментарий на отзыв через Ozon API."""
-    url = f"{OZON_API_URL}/v1/review/comment/create"
-    headers = {
-        "Client-Id": CLIENT_ID,
-        "Api-Key": OZON_TOKEN,
-        "Content-Type": "application/json",
-    }
     payload = {"mark_review_as_processed": True, "review_id": review_id, "text": text}
+    result = await _ozon_post("/v1/review/comment/create", payload, session)
+    if result is None:
+        return ""
 
-    try:
-        async with session.post(url, json=payload, headers=headers) as response:
-            result = await response.json()
-            if response.status == 200:
-                comment_id = result.get("comment_id", "")
-                if comment_id:
-                    logging.info(f"Комментарий успешно отправлен на отзыв ID: {review_id}, comment_id: {comment_id}")
-                else:
-                    logging.warning(f"Комментарий отправлен, но comment_id не получен для отзыва ID: {review_id}")
-                return comment_id
-            else:
-                logging.error(f"Ошибка при отправке комментария: {result}")
-    except aiohttp.ClientError as e:
-        logging.error(f"Ошибка сети при отправке комментария: {e}")
-    return ""
+    comment_id = result.get("comment_id", "")
+    if comment_id:
+        logging.info("Комментарий успешно отправлен на отзыв ID: %s, comment_id: %s", review_id, comment_id)
+    else:
+        logging.warning("Комментарий отправлен, но comment_id не получен для отзыва ID: %s", review_id)
+    return comment_id
+
+
+# Определение бренда по названию товара и шаблоны ссылок на карточку товара
+_DIANA_RE = re.compile("diana", re.IGNORECASE)
+_PRODUCT_URL_TEMPLATES: dict[str, str] = {
+    "Diana": "https://www.ozon.ru/product/polotentse-mahrovoe-diana-1-sht-50h90-visdom-hlopok-100-450-g-m2-{sku}/?at=PjtJn4mrrcpDJKlxi71M2m3Ux8Y9MYc7",
+    "Guten Morgen": "https://www.ozon.ru/product/polotentse-mahrovoe-guten-morgen-1-sht-50h90-visdom-hlopok-100-450-g-m2-{sku}/?at=PjtJn4mrrcpDJKlxi71M2m3Ux8Y9MYc7",
+}
+
+# Шаблон уведомления в канал и строки звезд для рейтингов 1–5
+_CHANNEL_MESSAGE_TEMPLATE = (
+    "Бренд: {brand}\n"
+    "{stars}\n"
+    "Артикул Ozon: {sku} (<a href='{url}'>Ссылка на карточку товара</a>)\n"
+    "Товар: {name}\n\n"
+    "💬 {user}\n{review}\n\n"
+    "✅ Отправлен ответ:\n{response}"
+)
+_STARS: tuple[str, ...] = tuple("⭐️" * count for count in range(1, 6))
+
+
+# Сообщения в канал отправляются по одному с паузой CHANNEL_SEND_INTERVAL
+_CHANNEL_LOCK = asyncio.Lock()
+_last_channel_send: float = 0.0
+
+
+async def _send_to_channel(text: str) -> None:
+    """Отправить сообщение в канал, соблюдая ограничение Telegram на частоту сообщений в один чат."""
+    global _last_channel_send
+    async with _CHANNEL_LOCK:
+        delay = _last_channel_send + CHANNEL_SEND_INTERVAL - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            for attempt in range(1, CHANNEL_SEND_RETRIES + 1):
+                try:
+                    await bot.send_message(NOTIFICATION_CHANNEL_ID, text, parse_mode="HTML")
+                    return
+                except TelegramRetryAfter as e:
+                    if attempt == CHANNEL_SEND_RETRIES:
+                        raise
+                    logging.warning("Telegram просит повторить отправку в канал через %s с", e.retry_after)
+                    await asyncio.sleep(e.retry_after)
+        finally:
+            _last_channel_send = time.monotonic()
 
 
 async def notify_channel(sku: int, response_text: str, rating: int, product_name: str, user_name: str, review_text: str) -> None:
     """Отправить уведомление в канал о новом комментарии."""
     user_name = user_name if user_name else "Аноним"
 
-    def determine_brand(product_name: str) -> str:
-        product_name_lower = product_name.lower() if product_name else ""
-        if "diana" in product_name_lower:
-            return "Diana"
-        elif "guten morgen" in product_name_lower:
-            return "Guten Morgen"
-        elif "gm" in product_name_lower:
-            return "Guten Morgen"
-        else:
-            return "Unknown"
-
-    brand_name = determine_brand(product_name)
-    if brand_name == "Unknown":
-        brand_name = "Guten Morgen"
-
-    if brand_name == "Diana":
-        product_url = f"https://www.ozon.ru/product/polotentse-mahrovoe-diana-1-sht-50h90-visdom-hlopok-100-450-g-m2-{sku}/?at=PjtJn4mrrcpDJKlxi71M2m3Ux8Y9MYc7"
-    elif brand_name == "Guten Morgen":
-        product_url = f"https://www.ozon.ru/product/polotentse-mahrovoe-guten-morgen-1-sht-50h90-visdom-hlopok-100-450-g-m2-{sku}/?at=PjtJn4mrrcpDJKlxi71M2m3Ux8Y9MYc7"
-    else:
-        product_url = f"https://www.ozon.ru/product/unknown-brand-{sku}/?at=PjtJn4mrrcpDJKlxi71M2m3Ux8Y9MYc7"
-
-    response_text = generate_response(rating, brand_name, product_name)
-
-    review_message = (
-        f"Бренд: {brand_name}\n"
-        f"⭐️{'⭐️' * (rating - 1)}\n"
-        f"Артикул Ozon: {sku} (<a href='{product_url}'>Ссылка на карточку товара</a>)\n"
-        f"Товар: {product_name}\n\n"
-        f"💬 {user_name}\n{review_text}\n\n"
-        f"✅ Отправлен ответ:\n{response_text}"
+    # «Guten Morgen», «GM» и неизвестные товары относятся к Guten Morgen, поэтому достаточно найти «diana»
+    brand_name = "Diana" if _DIANA_RE.search(product_name or "") else "Guten Morgen"
+    product_url = _PRODUCT_URL_TEMPLATES[brand_name].format(sku=sku)
+
+    # Сообщение отправляется с parse_mode="HTML" ради ссылки на товар, поэтому текст
+    # из отзыва экранируется: символы <, > и & в нем иначе ломают разбор сущностей
+    review_message = _CHANNEL_MESSAGE_TEMPLATE.format(
+        brand=brand_name,
+        stars=_STARS[min(max(rating, 1), 5) - 1],
+        sku=html.escape(str(sku)),
+        url=html.escape(product_url),
+        name=html.escape(product_name or ""),
+        user=html.escape(user_name),
+        review=html.escape(review_text or ""),
+        response=html.escape(response_text),
     )
 
     try:
-        await bot.send_message(NOTIFICATION_CHANNEL_ID, review_message, parse_mode="HTML")
-        logging.info(f"Сообщение отправлено в канал Telegram: {NOTIFICATION_CHANNEL_ID}")
+        await _send_to_channel(review_message)
+        logging.info("Сообщение отправлено в канал Telegram: %s", NOTIFICATION_CHANNEL_ID)
     except Exception as e:
-        logging.error(f"Ошибка отправки сообщения в Telegram: {e}")
+        logging.error("Ошибка отправки сообщения в Telegram: %s", e)
+
+
+# Шаблоны ответов по рейтингу; {brand} подставляется при выборе
+_RESPONSES: dict[int, tuple[str, ...]] = {
+    5: (
+        "Здравствуйте!Благодарим вас за позитивный отзыв! Надеемся и дальше видеть вас в числе постоянных покупателей Торговой Марки {brand}! Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand}.",
+        "Здравствуйте!Спасибо, что выбрали нас и оценили качество нашей продукции. Благодарим за покупку! Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand}.",
+        "Здравствуйте!Благодарим Вас за  отзыв! Мы рады, что вам все понравилось! Желаем приятных покупок. Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand}.",
+        "Здравствуйте!Спасибо за ваш прекрасный отзыв! Мы очень рады, что наш товар Вам понравился и оставил такое приятное впечатление. Желаем приятных покупок! Будем рады видеть Вас в числе наших постоянных покупателей. Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand}.",
+        "Здравствуйте!Благодарим за то, что нашли время, чтобы оценить наш товар и написать отзыв. Будем рады видеть Вас в числе наших постоянных покупателей. Желаем приятных покупок. Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand}.",
+        "Здравствуйте! Спасибо за выбор нашего товара. Нам очень приятно, что Вы по достоинству оценили качество нашей продукции. Благодарим за покупку! Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand}."
+    ),
+    4: (
+        "Здравствуйте! Благодарим за Ваш отзыв! Ваше мнение действительно важно для нас и помогает в совершенствовании наших услуг. Мы работаем над тем, чтобы каждый Ваш визит был удачным. Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! С уважением, Команда {brand}.",
+        "Здравствуйте! Спасибо за Вашу честную обратную связь. Для нас ценно знать, что Вы оценили наш сервис. Мы стремимся не только поддерживать, но и превосходить Ваши ожидания, поэтому будем признательны за любые рекомендации, которые помогут нам улучшиться. Желаем Вам приятных и удачных покупок. Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! С уважением, команда {brand}",
+    ),
+    3: (
+        "Здравствуйте! Благодарим за отзыв. Извините за доставленные неудобства. Ваши замечания — ценный вклад в наше стремление к совершенству, и мы сделаем все возможное, чтобы избежать подобных ситуаций в будущем. Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! С уважением, Команда{brand}.",
+        "Здравствуйте! Спасибо за ваше мнение. Нам жаль, что не всё прошло гладко. Ваше доверие — это наша главная ценность, и мы уже рассматриваем все возможности для улучшения на основе Ваших замечаний. Мы надеемся, что будущие взаимодействия будут удовлетворять Вас на все 100%. Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! С уважением, команда {brand}",
+    ),
+    2: (
+        "Здравствуйте! Благодарим за отзыв и приносим извинения за неудобства, с которыми Вы столкнулись. Ваша обратная связь позволяет нам улучшать наши услуги, и мы будем рады предоставить Вам лучший опыт в будущем. Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! С уважением, Команда {brand}.",
+        "Здравствуйте! Спасибо за ваш отзыв. Мы искренне извиняемся за все неудобства, которые могли возникнуть. Ваше мнение крайне важно для нас, и мы уверены, что с вашей помощью сможем выявить и устранить причины произошедшего. Ваш комфорт и удовлетворённость — наш приоритет. С уважением, команда {brand}",
+    ),
+    1: (  # Особое внимание для рейтинга 1
+        "Здравствуйте! Спасибо за Ваш отзыв. Нам жаль, что у Вас остались негативные впечатления. Мы внимательно рассмотрим Ваши комментарии, чтобы улучшить качество и предоставить Вам лучший опыт в будущем. Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! С уважением, Команда.{brand}.",
+        "Здравствуйте! Приносим извинения за доставленные неудобства и благодарим за Ваши замечания. Мы стремимся к высочайшему уровню обслуживания и надеемся, что Вы дадите нам шанс на исправление. Добавляйте бренд {brand} в список любимых, чтобы быть в курсе акций и новинок! С уважением и наилучшими пожеланиями, команда {brand}."
+
+    ),
+}
+
+# Ответ для рейтинга без шаблонов
+_FALLBACK_RESPONSES: tuple[str, ...] = ("Спасибо за Вашу оценку!",)
+
+
+def generate_response(rating: int, brand_name: str) -> str:
+    """Генерация шаблонного ответа для рейтинга и бренда."""
+    # Выбираем шаблон ответа в зависимости от рейтинга и подставляем только его
+    template = random.choice(_RESPONSES.get(rating, _FALLBACK_RESPONSES))
+    return template.format(brand=brand_name)
+
+
+async def process_review(review: dict, session: aiohttp.ClientSession) -> tuple | None:
+    """Ответить на один отзыв и уведомить канал. Возвращает строку для сохранения в базу или None."""
+    review_id = review.get("id")
+    review_text = review.get("text", "Отзыв отсутствует")
+    rating = review.get("rating", 0) or 1
+    sku = review.get("sku")
+    product_name = review.get("product_name")
+
+    # Получаем бренд из API, если отсутствует информация в отзыве
+    if not product_name and sku:
+        product_name, brand_name = await get_product_name_and_brand_by_sku(sku, session)
+    else:
+        brand_name = review.get("brand", "Guten Morgen")  # Используем бренд, если он указан в отзыве.
 
+    if not product_name:
+        logging.warning("Товар для SKU %s не найден, пропускаем обработку отзыва ID %s.", sku, review_id)
+        return None
 
-def generate_response(rating: int, brand_name: str, product_name: str) -> str:
-    """Генерация шаблонного ответа, включая исправление склонений для рейтинга 1 звезда."""
-    morph = pymorphy2.MorphAnalyzer()
+    # Генерация шаблонного ответа
+    response_text = generate_response(rating, brand_name)
 
-    # Извлекаем первое ключевое слово из названия товара
-    first_word = product_name.split()[0].lower() if product_name else "продукт"
-    first_word_parsed = morph.parse(first_word)[0]
+    # Отправляем комментарий
+    comment_id = await post_comment(review_id, response_text, session)
+    if not comment_id:
+        logging.error("Не удалось отправить комментарий для отзыва ID: %s", review_id)
+        return None
 
-    # Попытка склонения в родительном падеже
-    try:
-        first_word_genitive = first_word_parsed.inflect({'gent'}).word if first_word_parsed.inflect({'gent'}) else first_word
-    except:
-        first_word_genitive = first_word  # Значение по умолчанию
+    logging.info("Комментарий отправлен для отзыва ID: %s", review_id)
+    await notify_channel(sku, response_text, rating, product_name, "Аноним", review_text)
 
-    # Определяем род и согласуем грамматику (нашего/нашей/наших)
-    try:
-        gender = first_word_parsed.tag.gender
-        number = first_word_parsed.tag.number  # Единственное или множественное число
-
-        if number == 'plur':  # Множественное число
-            our_word = "наших"
-        elif gender == 'masc':  # Мужской род
-            our_word = "нашего"
-        elif gender == 'femn':  # Женский род
-            our_word = "нашей"
-        elif gender == 'neut':  # Средний род
-            our_word = "нашего"
-        else:
-            our_word = "нашей"  # Значение по умолчанию
-    except:
-        our_word = "нашей"  # Значение по умолчанию
-
-    # Выбираем шаблоны ответов в зависимости от рейтинга
-    responses = {
-        5: [
-            f"Здравствуйте!Благодарим вас за позитивный отзыв! Надеемся и дальше видеть вас в числе постоянных покупателей Торговой Марки {brand_name}! Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand_name}.",
-            f"Здравствуйте!Спасибо, что выбрали нас и оценили качество нашей продукции. Благодарим за покупку! Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand_name}.",
-            f"Здравствуйте!Благодарим Вас за  отзыв! Мы рады, что вам все понравилось! Желаем приятных покупок. Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand_name}.",
-            f"Здравствуйте!Спасибо за ваш прекрасный отзыв! Мы очень рады, что наш товар Вам понравился и оставил такое приятное впечатление. Желаем приятных покупок! Будем рады видеть Вас в числе наших постоянных покупателей. Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand_name}.",
-            f"Здравствуйте!Благодарим за то, что нашли время, чтобы оценить наш товар и написать отзыв. Будем рады видеть Вас в числе наших постоянных покупателей. Желаем приятных покупок. Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand_name}.",
-            f"Здравствуйте! Спасибо за выбор нашего товара. Нам очень приятно, что Вы по достоинству оценили качество нашей продукции. Благодарим за покупку! Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! C уважением, команда {brand_name}."
-        ],
-        4: [
-            f"Здравствуйте! Благодарим за Ваш отзыв! Ваше мнение действительно важно для нас и помогает в совершенствовании наших услуг. Мы работаем над тем, чтобы каждый Ваш визит был удачным. Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! С уважением, Команда {brand_name}.",
-            f"Здравствуйте! Спасибо за Вашу честную обратную связь. Для нас ценно знать, что Вы оценили наш сервис. Мы стремимся не только поддерживать, но и превосходить Ваши ожидания, поэтому будем признательны за любые рекомендации, которые помогут нам улучшиться. Желаем Вам приятных и удачных покупок. Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! С уважением, команда {brand_name}",
-        ],
-        3: [
-            f"Здравствуйте! Благодарим за отзыв. Извините за доставленные неудобства. Ваши замечания — ценный вклад в наше стремление к совершенству, и мы сделаем все возможное, чтобы избежать подобных ситуаций в будущем. Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! С уважением, Команда{brand_name}.",
-            f"Здравствуйте! Спасибо за ваше мнение. Нам жаль, что не всё прошло гладко. Ваше доверие — это наша главная ценность, и мы уже рассматриваем все возможности для улучшения на основе Ваших замечаний. Мы надеемся, что будущие взаимодействия будут удовлетворять Вас на все 100%. Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! С уважением, команда {brand_name}",
-        ],
-        2: [
-            f"Здравствуйте! Благодарим за отзыв и приносим извинения за неудобства, с которыми Вы столкнулись. Ваша обратная связь позволяет нам улучшать наши услуги, и мы будем рады предоставить Вам лучший опыт в будущем. Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! С уважением, Команда {brand_name}.",
-            f"Здравствуйте! Спасибо за ваш отзыв. Мы искренне извиняемся за все неудобства, которые могли возникнуть. Ваше мнение крайне важно для нас, и мы уверены, что с вашей помощью сможем выявить и устранить причины произошедшего. Ваш комфорт и удовлетворённость — наш приоритет. С уважением, команда {brand_name}",
-        ],
-        1: [  # Особое внимание для рейтинга 1
-            f"Здравствуйте! Спасибо за Ваш отзыв. Нам жаль, что у Вас остались негативные впечатления. Мы внимательно рассмотрим Ваши комментарии, чтобы улучшить качество и предоставить Вам лучший опыт в будущем. Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! С уважением, Команда.{brand_name}.",
-            f"Здравствуйте! Приносим извинения за доставленные неудобства и благодарим за Ваши замечания. Мы стремимся к высочайшему уровню обслуживания и надеемся, что Вы дадите нам шанс на исправление. Добавляйте бренд {brand_name} в список любимых, чтобы быть в курсе акций и новинок! С уважением и наилучшими пожеланиями, команда {brand_name}."
-
-        ],
-    }
-
-    # Берем случайный ответ из шаблонного списка
-    return random.choice(responses.get(rating, ["Спасибо за Вашу оценку!"]))
-
-
-async def get_unprocessed_reviews_count(session: aiohttp.ClientSession) -> int:
-    url = f"{OZON_API_URL}/v1/review/list"
-    headers = {
-        "Client-Id": CLIENT_ID,
-        "Api-Key": OZON_TOKEN,
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "limit": 20,  # Минимально допустимое значение
-        "status": "UNPROCESSED",
-    }
+    # Строка для сохранения в базу данных как обработанного отзыва
+    return review_id, str(sku), product_name, "Аноним", review_text, int(rating), response_text, str(comment_id)
 
-    try:
-        async with session.post(url, json=payload, headers=headers) as response:
-            result = await response.json()
-            logging.info(f"Полный ответ от API для подсчета отзывов: {result}")  # Логируем полный ответ
-            if response.status == 200:
-                total_reviews = result.get("total", 0)  # Поле для общего количества
-                logging.info(f"Общее количество необработанных отзывов: {total_reviews}")
-                return int(total_reviews)
-            else:
-                logging.error(f"Ошибка при запросе количества отзывов: {result}")
-    except aiohttp.ClientError as e:
-        logging.error(f"Ошибка сети при запросе количества отзывов: {e}")
-    return 0
-
-
-async def handle_reviews(session: aiohttp.ClientSession) -> None:
-    """Основной процесс обработки отзывов."""
+
+async def handle_reviews(session: aiohttp.ClientSession) -> int | None:
+    """
+    Основной процесс обработки отзывов.
+
+    Возвращает общее количество необработанных отзывов на Ozon или None, если их не удалось получить.
+    """
     logging.info("⏳ Проверка новых отзывов...")
 
-    # Получаем общее количество необработанных отзывов
+    # Один запрос возвращает и общее количество необработанных отзывов, и сами отзывы
     try:
-        total_unprocessed_reviews = await get_unprocessed_reviews_count(session)
+        unprocessed = await get_unprocessed_reviews(session)
     except Exception as e:
-        logging.error(f"Ошибка при получении количества необработанных отзывов: {e}")
-        return
+        logging.error("Ошибка при получении необработанных отзывов: %s", e)
+        return None
+    if unprocessed is None:
+        return None
+    total_unprocessed_reviews, reviews = unprocessed
 
     # Уведомляем в канал, если есть необработанные отзывы
     if total_unprocessed_reviews > 0:
         message = f"📋 На платформе Ozon есть <b>{total_unprocessed_reviews}</b> необработанных отзывов."
         await notify_users(message)
 
-    # Получаем сами необработанные отзывы
-    reviews = await get_unprocessed_reviews(session)
     if not reviews:
         logging.info("Нет новых отзывов для обработки.")
-        return
+        return total_unprocessed_reviews
 
-    for review in islice(reviews, 5):  # Обрабатываем первые 5 отзывов
+    pending = []
+    seen = set()
+    for review in reviews:
         review_id = review.get("id")
 
-        # Проверяем, был ли отзыв уже обработан
-        if is_review_processed(review_id):
-            logging.info(f"Отзыв {review_id} уже обработан, пропускаем.")
+        # Проверяем, был ли отзыв уже обработан (по множеству в памяти, без запроса к базе)
+        if review_id in _PROCESSED_IDS:
+            logging.info("Отзыв %s уже обработан, пропускаем.", review_id)
             continue
+        if review_id in seen:
+            logging.info("Отзыв %s повторяется в ответе Ozon, пропускаем дубликат.", review_id)
+            continue
+        seen.add(review_id)
+        pending.append(review)
 
-        review_text = review.get("text", "Отзыв отсутствует")
-        rating = review.get("rating", 0) or 1
-        sku = review.get("sku")
-        product_name = review.get("product_name")
-
-        # Получаем бренд из API, если отсутствует информация в отзыве
-        if not product_name and sku:
-            product_name, brand_name = await get_product_name_and_brand_by_sku(sku, session)
-        else:
-            brand_name = review.get("brand", "Guten Morgen")  # Используем бренд, если он указан в отзыве.
+    # Товары без названия в отзыве запрашиваем одним запросом на всю пачку. Запрос
+    # необязателен: при ошибке товары будут запрошены по одному при обработке отзывов
+    try:
+        await prefetch_products_info(
+            [review.get("sku") for review in pending if not review.get("product_name")],
+            session,
+        )
+    except Exception as e:
+        logging.error("Ошибка при пакетном запросе информации о товарах: %s", e)
 
-        if not product_name:
-            logging.warning(f"Товар для SKU {sku} не найден, пропускаем обработку отзыва ID {review_id}.")
-            continue
+    # Отзывы независимы друг от друга, поэтому обрабатываем их одновременно,
+    # ограничивая число параллельных запросов к Ozon семафором
+    semaphore = asyncio.Semaphore(REVIEW_CONCURRENCY)
 
-        # Генерация шаблонного ответа
-        response_text = generate_response(rating, brand_name, product_name)
+    async def bounded(review: dict) -> tuple | None:
+        async with semaphore:
+            return await process_review(review, session)
 
-        # Отправляем комментарий
-        comment_id = await post_comment(review_id, response_text, session)
-        if comment_id:
-            logging.info(f"Комментарий отправлен для отзыва ID: {review_id}")
-            await notify_channel(sku, response_text, rating, product_name, "Аноним", review_text)
+    results = await asyncio.gather(*(bounded(review) for review in pending), return_exceptions=True)
 
-            # Сохраняем отзыв в базу данных как обработанный
-            save_review_to_db(review_id, str(sku), product_name, "Аноним", review_text, int(rating), response_text, str(comment_id))
-        else:
-            logging.error(f"Не удалось отправить комментарий для отзыва ID: {review_id}")
+    # Ошибка в одном отзыве не должна мешать сохранить остальные
+    rows = []
+    for review, result in zip(pending, results):
+        if isinstance(result, BaseException):
+            logging.error("Ошибка при обработке отзыва ID %s: %s", review.get("id"), result)
+        elif result:
+            rows.append(result)
+    await asyncio.to_thread(save_reviews_to_db, rows)
+    return total_unprocessed_reviews
 
 
 async def scheduled_task(session: aiohttp.ClientSession) -> None:
-    """Планировщик обработки отзывов (обрабатывает 5 отзывов каждые 5 минут)."""
+    """
+    Планировщик обработки отзывов (обрабатывает все полученные отзывы каждые CHECK_INTERVAL секунд).
+
+    Интервал отсчитывается от начала цикла, поэтому долгая обработка не сдвигает расписание.
+    Пока на Ozon нет необработанных отзывов, интервал удваивается до MAX_CHECK_INTERVAL
+    и сбрасывается, как только они появляются. Если CHECK_INTERVAL больше MAX_CHECK_INTERVAL,
+    опрос идет с интервалом CHECK_INTERVAL без увеличения. Неудачный опрос (ошибка запроса
+    или обработки) не считается пустым: следующий опрос идет через CHECK_INTERVAL.
+    """
+    empty_streak = 0
     while True:
+        started = time.monotonic()
         try:
-            await handle_reviews(session)
+            total = await handle_reviews(session)
         except Exception as e:
-            logging.error(f"Ошибка при обработке отзывов: {e}")
-        await asyncio.sleep(CHECK_INTERVAL)
+            logging.error("Ошибка при обработке отзывов: %s", e)
+            total = None
+
+        if total is None:
+            # Ошибка не означает пустую очередь: повторяем через обычный интервал
+            interval = CHECK_INTERVAL
+        elif total:
+            empty_streak = 0
+            interval = CHECK_INTERVAL
+        else:
+            empty_streak = min(empty_streak + 1, 16)
+            # Предел ограничивает только увеличение интервала, но не сам CHECK_INTERVAL
+            interval = max(CHECK_INTERVAL, min(CHECK_INTERVAL * 2 ** empty_streak, MAX_CHECK_INTERVAL))
+        await asyncio.sleep(max(0.0, started + interval - time.monotonic()))
 
 
 async def main() -> None:
     init_db()
-    async with aiohttp.ClientSession() as session:
+    # Пул постоянных соединений: keep-alive и кэш DNS избавляют от повторных рукопожатий TCP/TLS
+    connector = aiohttp.TCPConnector(
+        limit=20,
+        limit_per_host=10,
+        keepalive_timeout=75,
+        ttl_dns_cache=300,
+        enable_cleanup_closed=True,
+    )
+    async with aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=30),
+        headers=_OZON_HEADERS,
+        json_serialize=_orjson_dumps,
+    ) as session:
         dp.include_router(router)
         asyncio.create_task(scheduled_task(session))
         await bot.delete_webhook(drop_pending_updates=True)
@@ -497,6 +647,13 @@ async def main() -> None:
 
 
 if __name__ == "__main__":
+    # uvloop — более быстрый цикл событий на libuv; необязателен и не поддерживает Windows
+    if sys.platform != "win32":
+        try:
+            import uvloop
+            uvloop.install()
+        except ImportError:
+            pass
     asyncio.run(main())
 
 